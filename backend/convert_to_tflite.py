@@ -0,0 +1,50 @@
+"""Convert flower_model.keras into a full-integer (INT8) quantized TFLite model.
+
+Run once from the backend directory:
+
+    python convert_to_tflite.py
+
+The flower_photos dataset used for training is downloaded to calibrate the
+activation ranges. main.py serves flower_model.tflite instead of the Keras
+model whenever that file exists.
+"""
+import pathlib
+
+import tensorflow as tf
+
+MODEL_PATH = "flower_model.keras"
+TFLITE_MODEL_PATH = "flower_model.tflite"
+IMAGE_SIZE = (180, 180)
+DATA_URL = "https://storage.googleapis.com/download.tensorflow.org/example_images/flower_photos.tgz"
+NUM_CALIBRATION_IMAGES = 200
+
+
+def representative_dataset():
+    base_dir = tf.keras.utils.get_file(origin=DATA_URL, fname="flower_photos", untar=True)
+    data_dir = pathlib.Path(base_dir) / "flower_photos"
+    ds = tf.keras.preprocessing.image_dataset_from_directory(
+        data_dir,
+        seed=123,
+        image_size=IMAGE_SIZE,
+        batch_size=1,
+    )
+    for images, _ in ds.take(NUM_CALIBRATION_IMAGES):
+        yield [images]
+
+
+def main():
+    model = tf.keras.models.load_model(MODEL_PATH)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    # Quantize every op to INT8 but keep float32 input/output so main.py can
+    # feed the same preprocessed tensors it gives the Keras model.
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    pathlib.Path(TFLITE_MODEL_PATH).write_bytes(converter.convert())
+    print(f"Saved quantized model to '{TFLITE_MODEL_PATH}'.")
+
+
+if __name__ == "__main__":
+    main()
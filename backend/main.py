@@ -1,11 +1,24 @@
-import io
+import asyncio
+import os
+import struct
+from functools import lru_cache
 import numpy as np
-from PIL import Image
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import grpc
+import orjson
 import tensorflow as tf
 
+# tf.lite.Interpreter is deprecated in favour of the standalone LiteRT package;
+# keep it only as a fallback for environments without ai-edge-litert.
+try:
+    from ai_edge_litert.interpreter import Interpreter
+except ImportError:
+    Interpreter = tf.lite.Interpreter
+
 # ##############################################################################
 # ## 1. SETUP YOUR BACKEND
 # ##############################################################################
@@ -22,6 +35,39 @@ CLASS_NAMES = [
 # --- Step 3: Update with the image size your model expects ---
 IMAGE_SIZE = (180, 180)
 
+# --- Step 4: Tune dynamic batching of concurrent /predict requests ---
+# Requests arriving within BATCH_TIMEOUT_MS of each other are stacked into a
+# single model call of at most MAX_BATCH_SIZE images.
+MAX_BATCH_SIZE = 32
+BATCH_TIMEOUT_MS = 5
+
+# --- Step 5: Limit the size of uploaded images ---
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+# Allowance for the multipart boundaries and part headers around the file.
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + 64 * 1024
+# Small compressed files can still expand to gigabytes of pixels, so the
+# dimensions in the image header are checked before decoding.
+MAX_IMAGE_PIXELS = 50_000_000
+
+# --- Step 6: Size TensorFlow's thread pools ---
+# Run a single uvicorn worker; these threads (not extra processes) use the
+# cores. Leaving TF to pick one thread per core in every worker oversubscribes
+# the CPU.
+INTRA_OP_THREADS = 4
+INTER_OP_THREADS = 2
+
+# --- Step 7 (optional): Serve an INT8-quantized TFLite model ---
+# Create it with `python convert_to_tflite.py`. When this file exists it is
+# used instead of MODEL_PATH.
+TFLITE_MODEL_PATH = "flower_model.tflite"
+
+# --- Step 8 (optional): gRPC endpoint for internal callers ---
+# Set GRPC_PORT (e.g. 50051) to serve /bloomai.Predictor/Predict: raw image
+# bytes in, the /predict JSON as bytes out. It has no authentication, so it
+# listens on localhost only unless GRPC_HOST is changed.
+GRPC_PORT = None
+GRPC_HOST = "127.0.0.1"
+
 
 # ##############################################################################
 # ## 2. LOAD THE MODEL (Done only once when the server starts)
@@ -29,6 +75,18 @@ IMAGE_SIZE = (180, 180)
 
 app = FastAPI(title="BloomAI Backend")
 
+UPLOAD_TOO_LARGE_DETAIL = f"Image file is too large. Maximum size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."
+
+# Reject oversized bodies from the Content-Length header before Starlette
+# receives and spools the multipart upload. Registered before CORSMiddleware
+# so the 413 still carries CORS headers for the browser.
+@app.middleware("http")
+async def limit_request_size(request, call_next):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_REQUEST_BYTES:
+        return JSONResponse(status_code=413, content={"detail": UPLOAD_TOO_LARGE_DETAIL})
+    return await call_next(request)
+
 # Allow requests from your frontend (running on localhost:9002)
 app.add_middleware(
     CORSMiddleware,
@@ -42,54 +100,377 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Only possible before any TensorFlow op executes. When main is imported into a
+# process that already ran TF, keep the pools that process configured.
 try:
-    model = tf.keras.models.load_model(MODEL_PATH)
-except Exception as e:
-    print(f"Error loading model: {e}")
-    print(f"Please ensure '{MODEL_PATH}' exists and is a valid Keras model.")
-    model = None
+    tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+    tf.config.threading.set_inter_op_parallelism_threads(INTER_OP_THREADS)
+except RuntimeError as e:
+    print(f"Could not set TensorFlow thread pools: {e}")
+    print("Keeping the existing intra/inter-op thread pool sizes.")
+
+# Run the model on the first GPU when there is one. Memory growth stops TF
+# from reserving the whole card up front.
+GPUS = tf.config.list_physical_devices("GPU")
+try:
+    for gpu in GPUS:
+        tf.config.experimental.set_memory_growth(gpu, True)
+except RuntimeError as e:
+    print(f"Could not enable GPU memory growth: {e}")
+    print("Keeping the existing GPU memory configuration.")
+INFERENCE_DEVICE = "/GPU:0" if GPUS else "/CPU:0"
+
+# Cached so the weights are only ever held once per process, even if the
+# loader is called again from another module or an interactive session.
+@lru_cache(maxsize=1)
+def load_model():
+    try:
+        return tf.keras.models.load_model(MODEL_PATH)
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        print(f"Please ensure '{MODEL_PATH}' exists and is a valid Keras model.")
+        return None
+
+@lru_cache(maxsize=1)
+def load_interpreter():
+    if not os.path.exists(TFLITE_MODEL_PATH):
+        return None
+    try:
+        interpreter = Interpreter(
+            model_path=TFLITE_MODEL_PATH, num_threads=INTRA_OP_THREADS
+        )
+        interpreter.allocate_tensors()
+        return interpreter
+    except Exception as e:
+        print(f"Error loading TFLite model: {e}")
+        print(f"Falling back to the Keras model at '{MODEL_PATH}'.")
+        return None
+
+interpreter = load_interpreter()
+model = None if interpreter else load_model()
+
+# Large JPEGs are shrunk while decoding: libjpeg-turbo can scale the DCT by
+# 1/2, 1/4 or 1/8, which is far cheaper than decoding every pixel and resizing
+# afterwards. The ratio is picked so the decoded image never drops below
+# IMAGE_SIZE, leaving the final resize to tf.image.resize.
+def _decode_jpeg(contents):
+    shape = tf.io.extract_jpeg_shape(contents)
+    shrink = tf.minimum(shape[0] // IMAGE_SIZE[0], shape[1] // IMAGE_SIZE[1])
+    branch = tf.reduce_sum(tf.cast(shrink >= [2, 4, 8], tf.int32))
+    return tf.switch_case(branch, [
+        lambda ratio=ratio: tf.io.decode_jpeg(contents, channels=3, ratio=ratio)
+        for ratio in (1, 2, 4, 8)
+    ])
+
+# Decode and resize inside one TF graph call instead of separate PIL/NumPy
+# passes over the pixels. Bilinear resize to float32 is also what
+# image_dataset_from_directory did during training.
+@tf.function(input_signature=[tf.TensorSpec([], tf.string)])
+def preprocess(contents):
+    image = tf.cond(
+        tf.io.is_jpeg(contents),
+        lambda: _decode_jpeg(contents),
+        lambda: tf.io.decode_image(contents, channels=3, expand_animations=False),
+    )
+    image.set_shape([None, None, 3])
+    return tf.image.resize(image, IMAGE_SIZE, method="bilinear")
+
+# Trace the forward pass once for a fixed input signature so each batch skips
+# the Python-side setup that model.predict() repeats on every call. XLA fuses
+# the rescaling/conv/activation chain into fewer kernels.
+@tf.function(
+    input_signature=[tf.TensorSpec([None, *IMAGE_SIZE, 3], tf.float32)],
+    jit_compile=True,
+)
+def infer(images):
+    with tf.device(INFERENCE_DEVICE):
+        return model(images, training=False)
+
+if model:
+    infer.get_concrete_function()
+
+
+# ##############################################################################
+# ## 3. DYNAMIC BATCHING (One model call for many concurrent requests)
+# ##############################################################################
+
+# XLA compiles once per input shape, so Keras batches are padded up to one of
+# these sizes instead of compiling for every size between 1 and MAX_BATCH_SIZE.
+# The TFLite interpreter is not padded; extra rows would only cost INT8 work.
+BATCH_BUCKETS = sorted({min(2 ** i, MAX_BATCH_SIZE) for i in range(MAX_BATCH_SIZE.bit_length() + 1)})
+
+def _bucket_size(n):
+    if interpreter:
+        return n
+    return next(size for size in BATCH_BUCKETS if size >= n)
+
+def _run_tflite(batch):
+    # The interpreter is only ever used from the single batch worker, so
+    # resizing and invoking it here is not racy.
+    input_details = interpreter.get_input_details()[0]
+    if input_details["shape"][0] != len(batch):
+        interpreter.resize_tensor_input(input_details["index"], batch.shape)
+        interpreter.allocate_tensors()
+    interpreter.set_tensor(input_details["index"], batch)
+    interpreter.invoke()
+    return interpreter.get_tensor(interpreter.get_output_details()[0]["index"])
+
+def _run_batch(batch):
+    if interpreter:
+        return _run_tflite(batch)
+    return infer(tf.constant(batch)).numpy()
+
+async def _batch_worker(queue):
+    loop = asyncio.get_running_loop()
+    # Reused for every batch instead of allocating a new stacked array. Safe
+    # because the next batch is only assembled after the current one finished.
+    # Rows past the real batch are padding; their predictions are dropped.
+    batch_buffer = np.zeros((MAX_BATCH_SIZE, *IMAGE_SIZE, 3), dtype=np.float32)
+    while True:
+        # Block for the first image, then collect more until the batch is full
+        # or the timeout expires.
+        items = [await queue.get()]
+        deadline = loop.time() + BATCH_TIMEOUT_MS / 1000
+        while len(items) < MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        arrays, futures = zip(*items)
+        try:
+            for i, array in enumerate(arrays):
+                batch_buffer[i] = array
+            batch = batch_buffer[:_bucket_size(len(arrays))]
+            # Run the model off the event loop so new requests keep queueing.
+            predictions = await asyncio.to_thread(_run_batch, batch)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        for future, scores in zip(futures, predictions):
+            if not future.done():
+                future.set_result(scores)
+
+INVALID_IMAGE_DETAIL = "Invalid image file. Unsupported or corrupt image."
+IMAGE_TOO_LARGE_DETAIL = f"Image dimensions are too large. Maximum is {MAX_IMAGE_PIXELS // 1_000_000} megapixels."
+
+class ImageTooLargeError(ValueError):
+    pass
+
+GIF_SIGNATURES = (b"GIF87a", b"GIF89a")
+
+def _skip_gif_sub_blocks(contents, pos):
+    while True:
+        size = contents[pos]
+        pos += 1 + size
+        if size == 0:
+            return pos
+
+# decode_image decodes every frame of an animated GIF even with
+# expand_animations=False, so cut the file after its first image and close it
+# with the trailer byte before handing it to TF.
+def _first_gif_frame(contents):
+    pos = 13
+    flags = contents[10]
+    if flags & 0x80:  # global color table
+        pos += 3 << ((flags & 0x07) + 1)
+    while True:
+        block = contents[pos]
+        if block == 0x21:  # extension: label, then data sub-blocks
+            pos = _skip_gif_sub_blocks(contents, pos + 2)
+        elif block == 0x2C:  # image descriptor, local color table, LZW data
+            flags = contents[pos + 9]
+            pos += 10
+            if flags & 0x80:
+                pos += 3 << ((flags & 0x07) + 1)
+            pos = _skip_gif_sub_blocks(contents, pos + 1)
+            return contents[:pos] + b"\x3b"
+        else:
+            raise ValueError("Malformed GIF file.")
+
+# Read (width, height) from the header of a JPEG, PNG, GIF, BMP or WebP file
+# without decoding any pixels. Any other format is rejected as unsupported.
+def _image_size(contents):
+    if contents[:3] == b"\xff\xd8\xff":
+        height, width = tf.io.extract_jpeg_shape(contents).numpy()[:2]
+        return int(width), int(height)
+    if contents[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", contents[16:24])
+    if contents[:6] in GIF_SIGNATURES:
+        return struct.unpack("<HH", contents[6:10])
+    if contents[:2] == b"BM":
+        if struct.unpack("<I", contents[14:18])[0] == 12:  # OS/2 core header
+            return struct.unpack("<HH", contents[18:22])
+        width, height = struct.unpack("<ii", contents[18:26])
+        return abs(width), abs(height)
+    if contents[:4] == b"RIFF" and contents[8:12] == b"WEBP":
+        chunk = contents[12:16]
+        if chunk == b"VP8X":
+            return (int.from_bytes(contents[24:27], "little") + 1,
+                    int.from_bytes(contents[27:30], "little") + 1)
+        if chunk == b"VP8L":
+            bits = int.from_bytes(contents[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", contents[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+    raise ValueError("Unrecognized image format.")
+
+# Decoding is blocking TF work; handlers run it in a thread so the event loop
+# keeps accepting requests and feeding the batch worker meanwhile.
+def _preprocess_bytes(contents):
+    width, height = _image_size(contents)
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(f"{width}x{height} image exceeds {MAX_IMAGE_PIXELS} pixels.")
+    if contents[:6] in GIF_SIGNATURES:
+        contents = _first_gif_frame(contents)
+    return preprocess(tf.constant(contents)).numpy()
+
+async def _submit(image_array):
+    future = asyncio.get_running_loop().create_future()
+    await app.state.batch_queue.put((image_array, future))
+    return await future
+
+@app.on_event("startup")
+def warm_up_model():
+    if not model and not interpreter:
+        return
+    # Pay for XLA compilation, kernel selection and cuDNN autotuning at every
+    # batch size the worker can emit before the first request arrives, rather
+    # than on the first request after each deploy. TFLite batches are not
+    # bucketed, so a single call is enough to prepare the interpreter.
+    for size in BATCH_BUCKETS if not interpreter else [1]:
+        _run_batch(np.zeros((size, *IMAGE_SIZE, 3), dtype=np.float32))
+    _preprocess_bytes(tf.io.encode_jpeg(tf.zeros([*IMAGE_SIZE, 3], tf.uint8)).numpy())
+
+@app.on_event("startup")
+async def start_batch_worker():
+    app.state.batch_queue = asyncio.Queue()
+    app.state.batch_worker = asyncio.create_task(_batch_worker(app.state.batch_queue))
+
+@app.on_event("shutdown")
+async def stop_batch_worker():
+    app.state.batch_worker.cancel()
+
+
+# ##############################################################################
+# ## 4. API ENDPOINTS
+# ##############################################################################
+
+# The root response never changes, so it is serialized once at import and
+# served from an async handler to skip the threadpool hop as well.
+_ROOT_JSON = orjson.dumps({"message": "Welcome to the BloomAI Prediction API!"})
 
 @app.get("/")
-def read_root():
-    return {"message": "Welcome to the BloomAI Prediction API!"}
+async def read_root():
+    return Response(content=_ROOT_JSON, media_type="application/json")
+
+# With a response model FastAPI serializes straight to JSON bytes in
+# Pydantic's Rust core, skipping jsonable_encoder and json.dumps.
+class Prediction(BaseModel):
+    prediction: str
+    confidence: float
+    probabilities: dict[str, float]
+
+def _format_prediction(scores):
+    predicted_index = int(scores.argmax())
+    predicted_class = CLASS_NAMES[predicted_index]
+
+    return {
+        "prediction": predicted_class,
+        "confidence": float(scores[predicted_index]),
+        "probabilities": dict(zip(CLASS_NAMES, scores.tolist()))
+    }
 
-@app.post("/predict")
+@app.post("/predict", response_model=Prediction)
 async def predict(image: UploadFile = File(...)): # Changed 'file' to 'image'
-    if not model:
+    if not model and not interpreter:
         raise HTTPException(status_code=500, detail="Model is not loaded. Please check server logs.")
 
     # 1. Read and preprocess the image
+    # Second guard for bodies without a Content-Length (chunked uploads): read at
+    # most one byte past the limit rather than the whole spooled file.
+    contents = await image.read(MAX_UPLOAD_BYTES + 1)
+    if len(contents) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE_DETAIL)
+
     try:
-        contents = await image.read()
-        image = Image.open(io.BytesIO(contents)).convert('RGB')
-        
         # Preprocess the image to match model's input requirements
-        image = image.resize(IMAGE_SIZE)
-        image_array = np.array(image)
+        image_array = await asyncio.to_thread(_preprocess_bytes, contents)
         # Do not normalize here because most training graphs already include a
         # Rescaling(1./255) layer. Double-normalization can degrade predictions.
-        
-        # Add a batch dimension
-        image_array = np.expand_dims(image_array, axis=0)
+        # The batch dimension is added by the batch worker.
 
+    except ImageTooLargeError:
+        raise HTTPException(status_code=413, detail=IMAGE_TOO_LARGE_DETAIL)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid image file. Error: {e}")
+        # TF errors embed the graph's Python call stack, so log the details
+        # and keep server paths out of the response.
+        print(f"Error decoding image: {e}")
+        raise HTTPException(status_code=400, detail=INVALID_IMAGE_DETAIL)
 
     # 2. Make prediction
     try:
-        predictions = model.predict(image_array)
-        
-        # 3. Post-process the prediction
-        scores = predictions[0]
-        score = float(np.max(scores))
-        predicted_index = np.argmax(scores)
-        predicted_class = CLASS_NAMES[predicted_index]
-
-        return {
-            "prediction": predicted_class,
-            "confidence": score,
-            "probabilities": {CLASS_NAMES[i]: float(scores[i]) for i in range(len(CLASS_NAMES))}
-        }
+        scores = await _submit(image_array)
+
+        return _format_prediction(scores)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to make prediction. Error: {e}")
+
+
+# ##############################################################################
+# ## 5. gRPC ENDPOINT (Same model, no multipart/JSON request framing)
+# ##############################################################################
+
+async def _grpc_predict(contents, context):
+    if not model and not interpreter:
+        await context.abort(grpc.StatusCode.UNAVAILABLE, "Model is not loaded. Please check server logs.")
+
+    try:
+        image_array = await asyncio.to_thread(_preprocess_bytes, contents)
+    except ImageTooLargeError:
+        await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, IMAGE_TOO_LARGE_DETAIL)
+    except Exception as e:
+        print(f"Error decoding image: {e}")
+        await context.abort(grpc.StatusCode.INVALID_ARGUMENT, INVALID_IMAGE_DETAIL)
+
+    try:
+        scores = await _submit(image_array)
+    except Exception as e:
+        await context.abort(grpc.StatusCode.INTERNAL, f"Failed to make prediction. Error: {e}")
+
+    return orjson.dumps(_format_prediction(scores))
+
+@app.on_event("startup")
+async def start_grpc_server():
+    if not GRPC_PORT:
+        return
+    # Without serializers the request and response are passed through as
+    # bytes, so there is nothing to decode beyond the gRPC frame itself.
+    handler = grpc.method_handlers_generic_handler("bloomai.Predictor", {
+        "Predict": grpc.unary_unary_rpc_method_handler(_grpc_predict),
+    })
+    server = grpc.aio.server(options=[("grpc.max_receive_message_length", MAX_UPLOAD_BYTES)])
+    server.add_generic_rpc_handlers((handler,))
+    # A taken port must not keep the HTTP API from starting.
+    try:
+        server.add_insecure_port(f"{GRPC_HOST}:{GRPC_PORT}")
+    except RuntimeError as e:
+        print(f"Error starting gRPC server: {e}")
+        print("Continuing without the gRPC endpoint.")
+        return
+    await server.start()
+    app.state.grpc_server = server
+
+@app.on_event("shutdown")
+async def stop_grpc_server():
+    server = getattr(app.state, "grpc_server", None)
+    if server:
+        await server.stop(grace=None)